@@ -1,14 +1,16 @@
 #!./kitty/launcher/kitty +launch
 # License: GPLv3 Copyright: 2022, Kovid Goyal <kovid at kovidgoyal.net>
 
+import difflib
 import io
 import json
 import os
-import subprocess
+import re
 import sys
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
 from contextlib import contextmanager, suppress
 from functools import lru_cache
-from typing import Any, Dict, Iterator, List, Optional, Sequence, Set, Tuple, Union
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Sequence, Set, Tuple
 
 import kitty.constants as kc
 from kittens.tui.operations import Mode
@@ -18,37 +20,40 @@
     GoOption,
     go_options_for_seq,
     parse_option_spec,
-    serialize_as_go_string,
 )
+from kitty.cli import serialize_as_go_string as uncached_serialize_as_go_string
 from kitty.key_encoding import config_mod_map
 from kitty.key_names import character_key_name_aliases, functional_key_name_aliases
+from kitty.multiprocessing import get_process_pool_executor
 from kitty.options.types import Options
-from kitty.rc.base import RemoteCommand, all_command_names, command_for_name
+from kitty.rc.base import all_command_names, command_for_name
 from kitty.remote_control import global_options_spec
 from kitty.rgb import color_names
 
 changed: List[str] = []
+pending_writes: List[Tuple[str, bytes]] = []
+serialize_as_go_string = lru_cache(maxsize=8192)(uncached_serialize_as_go_string)
+GeneratedFiles = List[Tuple[str, 'Future[str]']]
 
 
 # Utils {{{
 
-def serialize_go_dict(x: Union[Dict[str, int], Dict[int, str], Dict[int, int], Dict[str, str]]) -> str:
-    ans = []
+def serialize_go_str_dict(x: Dict[str, str]) -> str:
+    return '{' + ', '.join(f'"{serialize_as_go_string(k)}": "{serialize_as_go_string(v)}"' for k, v in x.items()) + '}'
+
 
-    def s(x: Union[int, str]) -> str:
-        if isinstance(x, int):
-            return str(x)
-        return f'"{serialize_as_go_string(x)}"'
+def serialize_go_int_dict(x: Dict[str, int]) -> str:
+    return '{' + ', '.join(f'"{serialize_as_go_string(k)}": {v}' for k, v in x.items()) + '}'
 
-    for k, v in x.items():
-        ans.append(f'{s(k)}: {s(v)}')
-    return '{' + ', '.join(ans) + '}'
 
+@lru_cache(maxsize=1024)
+def camel_case(x: str) -> str:
+    return ''.join(p.capitalize() for p in x.split('_'))
 
-def replace(template: str, **kw: str) -> str:
-    for k, v in kw.items():
-        template = template.replace(k, v)
-    return template
+
+@lru_cache(maxsize=None)
+def go_options_for_spec(spec: Optional[str] = None) -> Tuple[GoOption, ...]:
+    return tuple(go_options_for_seq(parse_option_spec(spec)[0]))
 # }}}
 
 
@@ -65,28 +70,29 @@ def go_options_for_kitten(kitten: str) -> Tuple[Sequence[GoOption], Optional[Com
     kcd = kitten_cli_docs(kitten)
     if kcd:
         ospec = kcd['options']
-        return (tuple(go_options_for_seq(parse_option_spec(ospec())[0])), kcd.get('args_completion'))
+        return go_options_for_spec(ospec()), kcd.get('args_completion')
     return (), None
 
 
-def generate_kittens_completion() -> None:
+def generate_kittens_completion(ans: List[str]) -> None:
     from kittens.runner import all_kitten_names, get_kitten_wrapper_of
+    a = ans.append
     for kitten in sorted(all_kitten_names()):
         kn = 'kitten_' + kitten
-        print(f'{kn} := plus_kitten.AddSubCommand(&cli.Command{{Name:"{kitten}", Group: "Kittens"}})')
+        a(f'{kn} := plus_kitten.AddSubCommand(&cli.Command{{Name:"{kitten}", Group: "Kittens"}})')
         wof = get_kitten_wrapper_of(kitten)
         if wof:
-            print(f'{kn}.ArgCompleter = cli.CompletionForWrapper("{serialize_as_go_string(wof)}")')
-            print(f'{kn}.OnlyArgsAllowed = true')
+            a(f'{kn}.ArgCompleter = cli.CompletionForWrapper("{serialize_as_go_string(wof)}")')
+            a(f'{kn}.OnlyArgsAllowed = true')
             continue
         gopts, ac = go_options_for_kitten(kitten)
         if gopts or ac:
             for opt in gopts:
-                print(opt.as_option(kn))
+                a(opt.as_option(kn))
             if ac is not None:
-                print(''.join(ac.as_go_code(kn + '.ArgCompleter', ' = ')))
+                a(''.join(ac.as_go_code(kn + '.ArgCompleter', ' = ')))
         else:
-            print(f'{kn}.HelpText = ""')
+            a(f'{kn}.HelpText = ""')
 
 
 @lru_cache
@@ -94,77 +100,78 @@ def clone_safe_launch_opts() -> Sequence[GoOption]:
     from kitty.launch import clone_safe_opts, options_spec
     ans = []
     allowed = clone_safe_opts()
-    for o in go_options_for_seq(parse_option_spec(options_spec())[0]):
+    for o in go_options_for_spec(options_spec()):
         if o.obj_dict['name'] in allowed:
             ans.append(o)
     return tuple(ans)
 
 
-def completion_for_launch_wrappers(*names: str) -> None:
-    for o in clone_safe_launch_opts():
-        for name in names:
-            print(o.as_option(name))
+def completion_for_launch_wrappers(ans: List[str], *names: str) -> None:
+    ans.extend(o.as_option(name) for o in clone_safe_launch_opts() for name in names)
 
 
-def generate_completions_for_kitty() -> None:
+def generate_completions_for_kitty() -> str:
     from kitty.config import option_names_for_completion
-    print('package completion\n')
-    print('import "kitty/tools/cli"')
-    print('import "kitty/tools/cmd/tool"')
-    print('import "kitty/tools/cmd/at"')
+    ans: List[str] = []
+    a = ans.append
+    a('package completion\n')
+    a('import "kitty/tools/cli"')
+    a('import "kitty/tools/cmd/tool"')
+    a('import "kitty/tools/cmd/at"')
     conf_names = ', '.join((f'"{serialize_as_go_string(x)}"' for x in option_names_for_completion()))
-    print('var kitty_option_names_for_completion = []string{' + conf_names + '}')
+    a('var kitty_option_names_for_completion = []string{' + conf_names + '}')
 
-    print('func kitty(root *cli.Command) {')
+    a('func kitty(root *cli.Command) {')
 
     # The kitty exe
-    print('k := root.AddSubCommand(&cli.Command{'
-          'Name:"kitty", SubCommandIsOptional: true, ArgCompleter: cli.CompleteExecutableFirstArg, SubCommandMustBeFirst: true })')
-    print('kt := root.AddSubCommand(&cli.Command{Name:"kitten", SubCommandMustBeFirst: true })')
-    print('tool.KittyToolEntryPoints(kt)')
-    for opt in go_options_for_seq(parse_option_spec()[0]):
-        print(opt.as_option('k'))
+    a('k := root.AddSubCommand(&cli.Command{'
+      'Name:"kitty", SubCommandIsOptional: true, ArgCompleter: cli.CompleteExecutableFirstArg, SubCommandMustBeFirst: true })')
+    a('kt := root.AddSubCommand(&cli.Command{Name:"kitten", SubCommandMustBeFirst: true })')
+    a('tool.KittyToolEntryPoints(kt)')
+    for opt in go_options_for_spec():
+        a(opt.as_option('k'))
 
     # kitty +
-    print('plus := k.AddSubCommand(&cli.Command{Name:"+", Group:"Entry points", ShortDescription: "Various special purpose tools and kittens"})')
+    a('plus := k.AddSubCommand(&cli.Command{Name:"+", Group:"Entry points", ShortDescription: "Various special purpose tools and kittens"})')
 
     # kitty +launch
-    print('plus_launch := plus.AddSubCommand(&cli.Command{'
-          'Name:"launch", Group:"Entry points", ShortDescription: "Launch Python scripts", ArgCompleter: complete_plus_launch})')
-    print('k.AddClone("", plus_launch).Name = "+launch"')
+    a('plus_launch := plus.AddSubCommand(&cli.Command{'
+      'Name:"launch", Group:"Entry points", ShortDescription: "Launch Python scripts", ArgCompleter: complete_plus_launch})')
+    a('k.AddClone("", plus_launch).Name = "+launch"')
 
     # kitty +list-fonts
-    print('plus_list_fonts := plus.AddSubCommand(&cli.Command{'
-          'Name:"list-fonts", Group:"Entry points", ShortDescription: "List all available monospaced fonts"})')
-    print('k.AddClone("", plus_list_fonts).Name = "+list-fonts"')
+    a('plus_list_fonts := plus.AddSubCommand(&cli.Command{'
+      'Name:"list-fonts", Group:"Entry points", ShortDescription: "List all available monospaced fonts"})')
+    a('k.AddClone("", plus_list_fonts).Name = "+list-fonts"')
 
     # kitty +runpy
-    print('plus_runpy := plus.AddSubCommand(&cli.Command{'
-          'Name: "runpy", Group:"Entry points", ArgCompleter: complete_plus_runpy, ShortDescription: "Run Python code"})')
-    print('k.AddClone("", plus_runpy).Name = "+runpy"')
+    a('plus_runpy := plus.AddSubCommand(&cli.Command{'
+      'Name: "runpy", Group:"Entry points", ArgCompleter: complete_plus_runpy, ShortDescription: "Run Python code"})')
+    a('k.AddClone("", plus_runpy).Name = "+runpy"')
 
     # kitty +open
-    print('plus_open := plus.AddSubCommand(&cli.Command{'
-          'Name:"open", Group:"Entry points", ArgCompleter: complete_plus_open, ShortDescription: "Open files and URLs"})')
-    print('for _, og := range k.OptionGroups { plus_open.OptionGroups = append(plus_open.OptionGroups, og.Clone(plus_open)) }')
-    print('k.AddClone("", plus_open).Name = "+open"')
+    a('plus_open := plus.AddSubCommand(&cli.Command{'
+      'Name:"open", Group:"Entry points", ArgCompleter: complete_plus_open, ShortDescription: "Open files and URLs"})')
+    a('for _, og := range k.OptionGroups { plus_open.OptionGroups = append(plus_open.OptionGroups, og.Clone(plus_open)) }')
+    a('k.AddClone("", plus_open).Name = "+open"')
 
     # kitty +kitten
-    print('plus_kitten := plus.AddSubCommand(&cli.Command{Name:"kitten", Group:"Kittens", SubCommandMustBeFirst: true})')
-    generate_kittens_completion()
-    print('k.AddClone("", plus_kitten).Name = "+kitten"')
+    a('plus_kitten := plus.AddSubCommand(&cli.Command{Name:"kitten", Group:"Kittens", SubCommandMustBeFirst: true})')
+    generate_kittens_completion(ans)
+    a('k.AddClone("", plus_kitten).Name = "+kitten"')
 
     # @
-    print('at.EntryPoint(k)')
+    a('at.EntryPoint(k)')
 
     # clone-in-kitty, edit-in-kitty
-    print('cik := root.AddSubCommand(&cli.Command{Name:"clone-in-kitty"})')
-    completion_for_launch_wrappers('cik')
+    a('cik := root.AddSubCommand(&cli.Command{Name:"clone-in-kitty"})')
+    completion_for_launch_wrappers(ans, 'cik')
 
-    print('}')
-    print('func init() {')
-    print('cli.RegisterExeForCompletion(kitty)')
-    print('}')
+    a('}')
+    a('func init() {')
+    a('cli.RegisterExeForCompletion(kitty)')
+    a('}')
+    return '\n'.join(ans) + '\n'
 # }}}
 
 
@@ -173,8 +180,28 @@ def generate_completions_for_kitty() -> None:
     'bool': 'bool', 'str': 'escaped_string', 'list.str': '[]escaped_string', 'dict.str': 'map[escaped_string]escaped_string', 'float': 'float64', 'int': 'int',
     'scroll_amount': 'any', 'spacing': 'any', 'colors': 'any',
 }
+json_field_type_prefixes: Dict[str, str] = {'list': '[]', 'dict': 'map[string]'}
+json_field_payload_wrappers: Dict[str, str] = {'str': 'escaped_string', 'list.str': 'escape_list_of_strings', 'dict.str': 'escape_dict_of_strings'}
+rc_template_placeholders = re.compile('(' + '|'.join(map(re.escape, (
+    'CMD_NAME', '__FILE__', 'CLI_NAME', 'SHORT_DESC', 'LONG_DESC', 'IS_ASYNC', 'NO_RESPONSE_BASE', 'ADD_FLAGS_CODE', 'WAIT_TIMEOUT',
+    'OPTIONS_DECLARATION_CODE', 'JSON_DECLARATION_CODE', 'JSON_INIT_CODE', 'ARGSPEC', 'STRING_RESPONSE_IS_ERROR', 'STREAM_WANTED',
+))) + ')')
+
+
+@lru_cache
+def compile_rc_template(template: str) -> Tuple[str, ...]:
+    # Alternating literal segments and placeholder names, starting and ending with a literal segment
+    template = '\n' + template[len('//go:build exclude'):]
+    return tuple(rc_template_placeholders.split(template))
+
+
+def render_rc_template(template: str, kw: Dict[str, str]) -> str:
+    parts = list(compile_rc_template(template))
+    parts[1::2] = (kw[k] for k in parts[1::2])
+    return ''.join(parts)
 
 
+@lru_cache(maxsize=None)
 def go_field_type(json_field_type: str) -> str:
     q = json_field_types.get(json_field_type)
     if q:
@@ -183,28 +210,42 @@ def go_field_type(json_field_type: str) -> str:
         return 'string'
     if '.' in json_field_type:
         p, r = json_field_type.split('.', 1)
-        p = {'list': '[]', 'dict': 'map[string]'}[p]
+        p = json_field_type_prefixes[p]
         return p + go_field_type(r)
     raise TypeError(f'Unknown JSON field type: {json_field_type}')
 
 
-class JSONField:
-
-    def __init__(self, line: str) -> None:
-        field_def = line.split(':', 1)[0]
-        self.required = False
-        self.field, self.field_type = field_def.split('/', 1)
-        if self.field.endswith('+'):
-            self.required = True
-            self.field = self.field[:-1]
-        self.struct_field_name = self.field[0].upper() + self.field[1:]
+class JSONField(NamedTuple):
+    field: str
+    field_type: str
+    required: bool
+    struct_field_name: str
 
     def go_declaration(self) -> str:
         return self.struct_field_name + ' ' + go_field_type(self.field_type) + f'`json:"{self.field},omitempty"`'
 
+    def payload_assignment(self, cmd_name: str, o: GoOption) -> str:
+        val = f'options_{cmd_name}.{o.go_var_name}'
+        wrapper = json_field_payload_wrappers.get(self.field_type)
+        if wrapper:
+            val = f'{wrapper}({val})'
+        return f'payload.{self.struct_field_name} = {val}'
 
-def go_code_for_remote_command(name: str, cmd: RemoteCommand, template: str) -> str:
-    template = '\n' + template[len('//go:build exclude'):]
+
+def parse_protocol_spec(spec: str) -> Iterator[JSONField]:
+    for line in spec.splitlines():
+        field_def, sep, _ = line.strip().partition(':')
+        if not sep:
+            continue
+        field, field_type = field_def.split('/', 1)
+        required = field.endswith('+')
+        if required:
+            field = field[:-1]
+        yield JSONField(field, field_type, required, field[0].upper() + field[1:])
+
+
+def go_code_for_remote_command(name: str, template: str) -> str:
+    cmd = command_for_name(name)
     NO_RESPONSE_BASE = 'false'
     af: List[str] = []
     a = af.append
@@ -217,37 +258,22 @@ def go_code_for_remote_command(name: str, cmd: RemoteCommand, template: str) ->
         if o.go_var_name in ('NoResponse', 'ResponseTimeout'):
             continue
         od.append(o.struct_declaration())
-    jd: List[str] = []
-    json_fields = []
-    field_types: Dict[str, str] = {}
-    for line in cmd.protocol_spec.splitlines():
-        line = line.strip()
-        if ':' not in line:
-            continue
-        f = JSONField(line)
-        json_fields.append(f)
-        field_types[f.field] = f.field_type
-        jd.append(f.go_declaration())
+    json_fields = tuple(parse_protocol_spec(cmd.protocol_spec))
+    field_types = {f.field: f.field_type for f in json_fields}
+    jd = [f.go_declaration() for f in json_fields]
     jc: List[str] = []
     handled_fields: Set[str] = set()
     jc.extend(cmd.args.as_go_code(name, field_types, handled_fields))
 
     unhandled = {}
     used_options = set()
+    field_to_option_map = cmd.field_to_option_map or {}
     for field in json_fields:
-        oq = (cmd.field_to_option_map or {}).get(field.field, field.field)
-        oq = ''.join(x.capitalize() for x in oq.split('_'))
-        if oq in option_map:
-            o = option_map[oq]
+        oq = camel_case(field_to_option_map.get(field.field, field.field))
+        opt = option_map.get(oq)
+        if opt is not None:
             used_options.add(oq)
-            if field.field_type == 'str':
-                jc.append(f'payload.{field.struct_field_name} = escaped_string(options_{name}.{o.go_var_name})')
-            elif field.field_type == 'list.str':
-                jc.append(f'payload.{field.struct_field_name} = escape_list_of_strings(options_{name}.{o.go_var_name})')
-            elif field.field_type == 'dict.str':
-                jc.append(f'payload.{field.struct_field_name} = escape_dict_of_strings(options_{name}.{o.go_var_name})')
-            else:
-                jc.append(f'payload.{field.struct_field_name} = options_{name}.{o.go_var_name}')
+            jc.append(field.payload_assignment(name, opt))
         elif field.field in handled_fields:
             pass
         else:
@@ -255,13 +281,7 @@ def go_code_for_remote_command(name: str, cmd: RemoteCommand, template: str) ->
     for x in tuple(unhandled):
         if x == 'match_window' and 'Match' in option_map and 'Match' not in used_options:
             used_options.add('Match')
-            o = option_map['Match']
-            field = unhandled[x]
-            if field.field_type == 'str':
-                jc.append(f'payload.{field.struct_field_name} = escaped_string(options_{name}.{o.go_var_name})')
-            else:
-                jc.append(f'payload.{field.struct_field_name} = options_{name}.{o.go_var_name}')
-            del unhandled[x]
+            jc.append(unhandled.pop(x).payload_assignment(name, option_map['Match']))
     if unhandled:
         raise SystemExit(f'Cant map fields: {", ".join(unhandled)} for cmd: {name}')
     if name != 'send_text':
@@ -272,8 +292,7 @@ def go_code_for_remote_command(name: str, cmd: RemoteCommand, template: str) ->
     argspec = cmd.args.spec
     if argspec:
         argspec = ' ' + argspec
-    ans = replace(
-        template,
+    kw = dict(
         CMD_NAME=name, __FILE__=__file__, CLI_NAME=name.replace('_', '-'),
         SHORT_DESC=serialize_as_go_string(cmd.short_desc),
         LONG_DESC=serialize_as_go_string(cmd.desc.strip()),
@@ -286,7 +305,7 @@ def go_code_for_remote_command(name: str, cmd: RemoteCommand, template: str) ->
         STRING_RESPONSE_IS_ERROR='true' if cmd.string_return_is_error else 'false',
         STREAM_WANTED='true' if cmd.reads_streaming_data else 'false',
     )
-    return ans
+    return render_rc_template(template, kw)
 # }}}
 
 
@@ -295,50 +314,48 @@ def go_code_for_remote_command(name: str, cmd: RemoteCommand, template: str) ->
 @lru_cache
 def wrapped_kittens() -> Sequence[str]:
     with open('shell-integration/ssh/kitty') as f:
-        for line in f:
-            if line.startswith('    wrapped_kittens="'):
-                val = line.strip().partition('"')[2][:-1]
-                return tuple(sorted(filter(None, val.split())))
-    raise Exception('Failed to read wrapped kittens from kitty wrapper script')
-
-
-def kitten_clis() -> None:
-    for kitten in wrapped_kittens():
-        with replace_if_needed(f'tools/cmd/{kitten}/cli_generated.go'):
-            od = []
-            kcd = kitten_cli_docs(kitten)
-            has_underscore = '_' in kitten
-            print(f'package {kitten}')
-            print('import "kitty/tools/cli"')
-            print('func create_cmd(root *cli.Command, run_func func(*cli.Command, *Options, []string)(int, error)) {')
-            print('ans := root.AddSubCommand(&cli.Command{')
-            print(f'Name: "{kitten}",')
-            print(f'ShortDescription: "{serialize_as_go_string(kcd["short_desc"])}",')
-            if kcd['usage']:
-                print(f'Usage: "[options] {serialize_as_go_string(kcd["usage"])}",')
-            print(f'HelpText: "{serialize_as_go_string(kcd["help_text"])}",')
-            print('Run: func(cmd *cli.Command, args []string) (int, error) {')
-            print('opts := Options{}')
-            print('err := cmd.GetOptionValues(&opts)')
-            print('if err != nil { return 1, err }')
-            print('return run_func(cmd, &opts, args)},')
-            if has_underscore:
-                print('Hidden: true,')
-            print('})')
-            gopts, ac = go_options_for_kitten(kitten)
-            for opt in gopts:
-                print(opt.as_option('ans'))
-                od.append(opt.struct_declaration())
-            if ac is not None:
-                print(''.join(ac.as_go_code('ans.ArgCompleter', ' = ')))
-            if has_underscore:
-                print("clone := root.AddClone(ans.Group, ans)")
-                print('clone.Hidden = false')
-                print(f'clone.Name = "{serialize_as_go_string(kitten.replace("_", "-"))}"')
-            print('}')
-            print('type Options struct {')
-            print('\n'.join(od))
-            print('}')
+        m = re.search(r'^    wrapped_kittens="([^"]*)"', f.read(), re.MULTILINE)
+    if m is None:
+        raise Exception('Failed to read wrapped kittens from kitty wrapper script')
+    return tuple(sorted(filter(None, m.group(1).split())))
+
+
+def kitten_cli(kitten: str) -> str:
+    kcd = kitten_cli_docs(kitten)
+    has_underscore = '_' in kitten
+    gopts, ac = go_options_for_kitten(kitten)
+    usage = f'Usage: "[options] {serialize_as_go_string(kcd["usage"])}",\n' if kcd['usage'] else ''
+    hidden = 'Hidden: true,\n' if has_underscore else ''
+    add_opts = ''.join(opt.as_option('ans') + '\n' for opt in gopts)
+    if ac is not None:
+        add_opts += ''.join(ac.as_go_code('ans.ArgCompleter', ' = ')) + '\n'
+    clone = ''
+    if has_underscore:
+        clone = f'clone := root.AddClone(ans.Group, ans)\nclone.Hidden = false\nclone.Name = "{serialize_as_go_string(kitten.replace("_", "-"))}"\n'
+    od = '\n'.join(opt.struct_declaration() for opt in gopts)
+    return f'''\
+package {kitten}
+import "kitty/tools/cli"
+func create_cmd(root *cli.Command, run_func func(*cli.Command, *Options, []string)(int, error)) {{
+ans := root.AddSubCommand(&cli.Command{{
+Name: "{kitten}",
+ShortDescription: "{serialize_as_go_string(kcd["short_desc"])}",
+{usage}HelpText: "{serialize_as_go_string(kcd["help_text"])}",
+Run: func(cmd *cli.Command, args []string) (int, error) {{
+opts := Options{{}}
+err := cmd.GetOptionValues(&opts)
+if err != nil {{ return 1, err }}
+return run_func(cmd, &opts, args)}},
+{hidden}}})
+{add_opts}{clone}}}
+type Options struct {{
+{od}
+}}
+'''
+
+
+def kitten_clis(executor: Executor) -> GeneratedFiles:
+    return [(f'tools/cmd/{kitten}/cli_generated.go', executor.submit(kitten_cli, kitten)) for kitten in wrapped_kittens()]
 
 # }}}
 
@@ -378,7 +395,7 @@ def load_ref_map() -> Dict[str, Dict[str, str]]:
     with open('kitty/docs_ref_map_generated.h') as f:
         raw = f.read()
     raw = raw.split('{', 1)[1].split('}', 1)[0]
-    data = json.loads(bytes(bytearray(json.loads(f'[{raw}]'))))
+    data = json.loads(bytes(int(x) for x in raw.split(',')))
     return data  # type: ignore
 
 
@@ -400,64 +417,79 @@ def generate_constants() -> str:
 const HandleTermiosSignals = {Mode.HANDLE_TERMIOS_SIGNALS.value[0]}
 var Version VersionType = VersionType{{Major: {kc.version.major}, Minor: {kc.version.minor}, Patch: {kc.version.patch},}}
 var DefaultPager []string = []string{{ {dp} }}
-var FunctionalKeyNameAliases = map[string]string{serialize_go_dict(functional_key_name_aliases)}
-var CharacterKeyNameAliases = map[string]string{serialize_go_dict(character_key_name_aliases)}
-var ConfigModMap = map[string]uint16{serialize_go_dict(config_mod_map)}
-var RefMap = map[string]string{serialize_go_dict(ref_map['ref'])}
-var DocTitleMap = map[string]string{serialize_go_dict(ref_map['doc'])}
+var FunctionalKeyNameAliases = map[string]string{serialize_go_str_dict(functional_key_name_aliases)}
+var CharacterKeyNameAliases = map[string]string{serialize_go_str_dict(character_key_name_aliases)}
+var ConfigModMap = map[string]uint16{serialize_go_int_dict(config_mod_map)}
+var RefMap = map[string]string{serialize_go_str_dict(ref_map['ref'])}
+var DocTitleMap = map[string]string{serialize_go_str_dict(ref_map['doc'])}
 '''  # }}}
 
 
 # Boilerplate {{{
 
 @contextmanager
-def replace_if_needed(path: str, show_diff: bool = False) -> Iterator[io.StringIO]:
-    buf = io.StringIO()
+def replace_if_needed(path: str, show_diff: bool = False) -> Iterator[io.TextIOWrapper]:
+    raw = io.BytesIO()
+    buf = io.TextIOWrapper(raw, encoding='utf-8', newline='\n', write_through=True)
+    buf.write(f'// Code generated by {os.path.basename(__file__)}; DO NOT EDIT.\n\n')
     origb = sys.stdout
     sys.stdout = buf
     try:
         yield buf
     finally:
         sys.stdout = origb
-    orig = ''
-    with suppress(FileNotFoundError), open(path, 'r') as f:
-        orig = f.read()
-    new = buf.getvalue()
-    new = f'// Code generated by {os.path.basename(__file__)}; DO NOT EDIT.\n\n' + new
-    if orig != new:
+    buf.flush()
+    new = raw.getvalue()
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        needs_update = True
+    else:
+        # a size mismatch means the contents differ, no need to read the file
+        needs_update = st.st_size != len(new)
+        if not needs_update:
+            with open(path, 'rb') as f:
+                needs_update = f.read() != new
+    if needs_update:
         changed.append(path)
         if show_diff:
-            with open(path + '.new', 'w') as f:
-                f.write(new)
-                subprocess.run(['diff', '-Naurp', path, f.name], stdout=open('/dev/tty', 'w'))
-                os.remove(f.name)
-        with open(path, 'w') as f:
-            f.write(new)
+            orig = b''
+            with suppress(FileNotFoundError), open(path, 'rb') as f:
+                orig = f.read()
+            sys.stderr.writelines(difflib.unified_diff(
+                orig.decode('utf-8').splitlines(keepends=True), new.decode('utf-8').splitlines(keepends=True), path, path + '.new'))
+        pending_writes.append((path, new))
+
+
+def write_atomic(path: str, data: bytes) -> None:
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def flush_pending_writes() -> None:
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        for _ in executor.map(lambda x: write_atomic(*x), pending_writes):
+            pass
+    del pending_writes[:]
 
 
 @lru_cache(maxsize=256)
 def rc_command_options(name: str) -> Tuple[GoOption, ...]:
     cmd = command_for_name(name)
-    return tuple(go_options_for_seq(parse_option_spec(cmd.options_spec or '\n\n')[0]))
+    return go_options_for_spec(cmd.options_spec or '\n\n')
 
 
-def update_at_commands() -> None:
-    with open('tools/cmd/at/template.go') as f:
-        template = f.read()
-    for name in all_command_names():
-        cmd = command_for_name(name)
-        code = go_code_for_remote_command(name, cmd, template)
-        dest = f'tools/cmd/at/cmd_{name}_generated.go'
-        with replace_if_needed(dest) as f:
-            f.write(code)
+def generate_rc_global_opts() -> str:
     struct_def = []
     opt_def = []
-    for o in go_options_for_seq(parse_option_spec(global_options_spec())[0]):
+    for o in go_options_for_spec(global_options_spec()):
         struct_def.append(o.struct_declaration())
         opt_def.append(o.as_option(depth=1, group="Global options"))
     sdef = '\n'.join(struct_def)
     odef = '\n'.join(opt_def)
-    code = f'''
+    return f'''
 package at
 import "kitty/tools/cli"
 type rc_global_options struct {{
@@ -469,20 +501,35 @@ def update_at_commands() -> None:
 {odef}
 }}
 '''
-    with replace_if_needed('tools/cmd/at/global_opts_generated.go') as f:
-        f.write(code)
 
 
-def update_completion() -> None:
-    with replace_if_needed('tools/cmd/completion/kitty_generated.go'):
-        generate_completions_for_kitty()
-    with replace_if_needed('tools/cmd/edit_in_kitty/launch_generated.go'):
-        print('package edit_in_kitty')
-        print('import "kitty/tools/cli"')
-        print('func AddCloneSafeOpts(cmd *cli.Command) {')
-        completion_for_launch_wrappers('cmd')
-        print(''.join(CompletionSpec.from_string('type:file mime:text/* group:"Text files"').as_go_code('cmd.ArgCompleter', ' = ')))
-        print('}')
+def update_at_commands(executor: Executor) -> GeneratedFiles:
+    with open('tools/cmd/at/template.go') as f:
+        template = f.read()
+    ans: GeneratedFiles = []
+    for name in all_command_names():
+        ans.append((f'tools/cmd/at/cmd_{name}_generated.go', executor.submit(go_code_for_remote_command, name, template)))
+    ans.append(('tools/cmd/at/global_opts_generated.go', executor.submit(generate_rc_global_opts)))
+    return ans
+
+
+def generate_launch_wrappers() -> str:
+    ans: List[str] = []
+    a = ans.append
+    a('package edit_in_kitty')
+    a('import "kitty/tools/cli"')
+    a('func AddCloneSafeOpts(cmd *cli.Command) {')
+    completion_for_launch_wrappers(ans, 'cmd')
+    a(''.join(CompletionSpec.from_string('type:file mime:text/* group:"Text files"').as_go_code('cmd.ArgCompleter', ' = ')))
+    a('}')
+    return '\n'.join(ans) + '\n'
+
+
+def update_completion(executor: Executor) -> GeneratedFiles:
+    return [
+        ('tools/cmd/completion/kitty_generated.go', executor.submit(generate_completions_for_kitty)),
+        ('tools/cmd/edit_in_kitty/launch_generated.go', executor.submit(generate_launch_wrappers)),
+    ]
 
 
 def define_enum(package_name: str, type_name: str, items: str, underlying_type: str = 'uint') -> str:
@@ -563,17 +610,20 @@ def generate_readline_actions() -> str:
 
 
 def main() -> None:
-    with replace_if_needed('constants_generated.go') as f:
-        f.write(generate_constants())
-    with replace_if_needed('tools/utils/style/color-names_generated.go') as f:
-        f.write(generate_color_names())
-    with replace_if_needed('tools/tui/readline/actions_generated.go') as f:
-        f.write(generate_readline_actions())
-    with replace_if_needed('tools/tui/spinners_generated.go') as f:
-        f.write(generate_spinners())
-    update_completion()
-    update_at_commands()
-    kitten_clis()
+    with get_process_pool_executor(prefer_fork=True) as executor:
+        jobs: GeneratedFiles = [
+            ('constants_generated.go', executor.submit(generate_constants)),
+            ('tools/utils/style/color-names_generated.go', executor.submit(generate_color_names)),
+            ('tools/tui/readline/actions_generated.go', executor.submit(generate_readline_actions)),
+            ('tools/tui/spinners_generated.go', executor.submit(generate_spinners)),
+        ]
+        jobs += update_completion(executor)
+        jobs += update_at_commands(executor)
+        jobs += kitten_clis(executor)
+        for dest, job in jobs:
+            with replace_if_needed(dest) as f:
+                f.write(job.result())
+    flush_pending_writes()
     print(json.dumps(changed, indent=2))
 
 